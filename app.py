@@ -4,186 +4,590 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
+import asyncio
+import contextvars
+import functools
+import hashlib
+import html
+import json
+import random
+import re
+import threading
+import time
+import httpx
 import litellm
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+import markdown2
+import zstandard as zstd
+from requests.adapters import HTTPAdapter
+from diskcache import Cache
+from litellm.caching import Cache as LiteLLMCache
+from litellm.integrations.custom_logger import CustomLogger
 from crewai import Crew, Task, Agent, Process, LLM
+from crewai.core.providers.content_processor import process_content
 from crewai_tools import TavilySearchTool
+from pydantic import PrivateAttr
 
-
-# === ROBUST MONKEY PATCH: Remove 'stop' parameter for Perplexity ===
+# === PERPLEXITY PARAMS: Let litellm drop unsupported params such as 'stop' ===
 # This must be done before any LLM initialization
-def remove_stop_sequences(func):
-    """Decorator to remove stop sequences from kwargs"""
+litellm.drop_params = True
+litellm.modify_params = True
+
+
+# === RATE LIMITING: One token bucket shared by every Perplexity call ===
+class TokenBucket:
+    """Thread-safe token bucket shared by every thread that calls the LLM"""
+
+    def __init__(self, max_rate, time_period):
+        self.capacity = max_rate
+        self.fill_rate = max_rate / time_period
+        self.tokens = max_rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _reserve(self):
+        """Take a token and return how long the caller must wait for it"""
+        with self.lock:
+            now = time.monotonic()
+            elapsed = now - self.updated
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.fill_rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.fill_rate)
+
+    def acquire(self):
+        time.sleep(self._reserve())
+
+
+@st.cache_resource
+def get_rate_limiter():
+    return TokenBucket(max_rate=10, time_period=60)
+
+
+class RateLimitHook(CustomLogger):
+    """Wait for a shared token right before each request goes out to the API"""
+
+    # litellm calls this after its cache lookup, so cache hits don't use up tokens
+    rate_limit_hook = True
+
+    def log_pre_api_call(self, model, messages, kwargs):
+        get_rate_limiter().acquire()
+
+
+# Streamlit re-runs this module on every interaction, so only register once.
+# The hook blocks the calling thread: crew kickoffs and batch reports call the
+# sync completion API from worker threads.
+if not any(getattr(cb, "rate_limit_hook", False) for cb in litellm.callbacks):
+    litellm.callbacks.append(RateLimitHook())
+
+
+# === CONNECTION POOLING: Reuse keep-alive connections across LLM calls ===
+@st.cache_resource
+def get_http_client():
+    return httpx.Client(
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        http2=True,
+    )
+
+
+# Crew kickoffs run in worker threads and call the sync completion API
+litellm.client_session = get_http_client()
+
+
+# Cached reports and completions expire together
+REPORT_CACHE_TTL = 24 * 60 * 60  # seconds
+
+
+# === COMPLETION CACHE: Identical model + prompt calls are answered from disk ===
+@st.cache_resource
+def get_completion_cache():
+    return LiteLLMCache(
+        type="disk",
+        disk_cache_dir=".litellm_cache",
+        ttl=REPORT_CACHE_TTL,
+        supported_call_types=["completion", "acompletion"],
+    )
+
+
+litellm.cache = get_completion_cache()
+
+# Set on retry attempts so a cached bad response isn't replayed. asyncio.to_thread
+# (and so CrewAI's kickoff_async) copies the context into its worker thread.
+skip_completion_cache = contextvars.ContextVar("skip_completion_cache", default=False)
+
+
+def cache_controlled(func):
+    """Skip the completion cache lookup while skip_completion_cache is set"""
 
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        # Remove stop-related parameters
-        kwargs.pop("stop", None)
-        kwargs.pop("stop_sequences", None)
+        if skip_completion_cache.get():
+            kwargs.setdefault("cache", {"no-cache": True})
         return func(*args, **kwargs)
 
+    wrapper.cache_controlled = True
     return wrapper
 
 
-# Apply patch to litellm
-litellm.completion = remove_stop_sequences(litellm.completion)
-litellm.acompletion = remove_stop_sequences(litellm.acompletion)
+# Streamlit re-runs this module on every interaction, so only patch once
+if not getattr(litellm.completion, "cache_controlled", False):
+    litellm.completion = cache_controlled(litellm.completion)
+if not getattr(litellm.acompletion, "cache_controlled", False):
+    litellm.acompletion = cache_controlled(litellm.acompletion)
+
+
+# === REPORT CACHE: Skip the whole crew for recently analyzed companies ===
+@st.cache_resource
+def get_report_cache():
+    return Cache("./.report_cache")
+
+
+# === INPUT VALIDATION: Reject garbage names before any LLM or search call ===
+_NAME_RE = re.compile(r"^[^\W_][\w\s&.,'()!*+/\-]{0,80}$")
+
+
+def is_valid_company_name(company_name):
+    return _NAME_RE.match(company_name.strip()) is not None
+
+
+def report_cache_key(company_name):
+    """Normalize the company name so 'Tata  Motors' and 'tata motors' share a key"""
+    normalized = " ".join(company_name.split()).casefold()
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def llm_settings():
+    """Model settings shared by the agents' LLM and the direct report completion"""
+    return {
+        "model": "perplexity/sonar",  # Keep the prefix
+        "api_key": os.environ.get("PERPLEXITY_API_KEY"),
+        "temperature": 0.7,  # Increase temperature slightly
+    }
 
 
 # Setup LLM with corrected configuration
 @st.cache_resource
 def get_llm():
-    return LLM(
-        model="perplexity/sonar",  # Keep the prefix
-        api_key=os.environ.get("PERPLEXITY_API_KEY"),
-        temperature=0.7,  # Increase temperature slightly
-        max_tokens=4000,  # Add max_tokens
-    )
+    return LLM(**llm_settings(), max_tokens=4000)  # Add max_tokens
 
 
 # Setup search tool
 @st.cache_resource
 def get_search_tool():
-    return TavilySearchTool(
+    tool = TavilySearchTool(
         max_results=2,  # Reduce to avoid timeout
         include_answer=True,
     )
+    # Widen the Tavily client's session pool so concurrent searches share
+    # connections (tavily-python < 0.7.20 has no session and uses plain requests)
+    session = getattr(tool.client, "session", None)
+    if session is not None:
+        adapter = HTTPAdapter(pool_connections=20, pool_maxsize=20)
+        session.mount("https://", adapter)
+    return tool
 
 
-# Initialize crew
-@st.cache_resource
-def initialize_crew():
-    llm = get_llm()
-    search_tool = get_search_tool()
+# === SEARCH POOL: One upfront batch of searches shared by every analyst ===
+SEARCH_QUERIES = [
+    "{company} latest quarterly results revenue growth",
+    "{company} EBITDA and net profit margin",
+    "{company} debt to equity ratio balance sheet",
+    "{company} management guidance earnings call",
+    "{company} industry outlook and competitors",
+    "{company} competitive advantages risks and opportunities",
+]
+
+
+# st.cache_data survives reruns, unlike a module-level lru_cache
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def cached_search(company_name, query):
+    return get_search_tool().run(query=query.format(company=company_name))
+
+
+class SearchUnavailableError(Exception):
+    """Every search query failed, so there is nothing to analyze"""
+
+
+def try_search(company_name, query):
+    """Return the search result, or the exception if the query failed"""
+    try:
+        return cached_search(company_name, query)
+    except Exception as e:
+        return e
+
+
+def gather_search_context(company_name):
+    """Run all search queries concurrently and format them as prompt context"""
+    company_name = " ".join(company_name.split())
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(
+            executor.map(lambda query: try_search(company_name, query), SEARCH_QUERIES)
+        )
+
+    # A few failed queries are fine, the agents work with the rest; none at all
+    # (missing key, outage, rate limit) is an error the retry logic should see
+    if all(isinstance(result, Exception) for result in results):
+        raise SearchUnavailableError(f"All web searches failed: {results[0]}")
+
+    return "\n\n".join(
+        f"### {query.format(company=company_name)}\n"
+        + (
+            f"Search results unavailable ({result})"
+            if isinstance(result, Exception)
+            else result
+        )
+        for query, result in zip(SEARCH_QUERIES, results)
+    )
+
+
+# === PRECOMPILED TASKS: Compile task templates once, fill them per kickoff ===
+_PLACEHOLDER_RE = re.compile(r"\{([A-Za-z_]\w*)\}")
+
+
+def compile_template(text):
+    """Turn a '{name}' task template into a str.format string, escaping literal braces"""
+    # re.split alternates literal text (even indexes) and placeholder names (odd)
+    parts = _PLACEHOLDER_RE.split(text)
+    return "".join(
+        "{" + part + "}" if i % 2 else part.replace("{", "{{").replace("}", "}}")
+        for i, part in enumerate(parts)
+    )
 
+
+class PrecompiledTask(Task):
+    """Task that interpolates inputs with one format_map on precompiled templates"""
+
+    _description_template = PrivateAttr(default=None)
+    _expected_output_template = PrivateAttr(default=None)
+
+    def interpolate_inputs_and_add_conversation_history(self, inputs):
+        # The fast path only fills description and expected_output; output_file
+        # paths and crew chat history are left to the base implementation
+        if self.output_file is not None or (
+            inputs and inputs.get("crew_chat_messages")
+        ):
+            super().interpolate_inputs_and_add_conversation_history(inputs)
+            return
+
+        if self._description_template is None:
+            self._original_description = self._original_description or self.description
+            self._original_expected_output = (
+                self._original_expected_output or self.expected_output
+            )
+            self._description_template = compile_template(self._original_description)
+            self._expected_output_template = compile_template(
+                self._original_expected_output
+            )
+
+        if not inputs:
+            return
+
+        try:
+            description = self._description_template.format_map(inputs)
+            expected_output = self._expected_output_template.format_map(inputs)
+        except KeyError as e:
+            raise ValueError(f"Missing required template variable '{e.args[0]}'") from e
+
+        # Same content processor hook the base implementation runs
+        self.description = process_content(description, {"task": self})
+        self.expected_output = process_content(expected_output, {"task": self})
+
+    def copy(self, agents, task_mapping):
+        # Carry the templates over so copies (e.g. kickoff_for_each_async) never
+        # start from an already interpolated description
+        task = super().copy(agents, task_mapping)
+        task._original_description = self._original_description
+        task._original_expected_output = self._original_expected_output
+        task._description_template = self._description_template
+        task._expected_output_template = self._expected_output_template
+        return task
+
+
+class TemplateAgent(Agent):
+    """Agent whose copies start from the uninterpolated role, goal and backstory"""
+
+    def copy(self):
+        # Agent.copy rebuilds from the current fields, which a previous kickoff
+        # has already filled in ("Analyze Tata ..."), so put the templates back
+        agent = super().copy()
+        agent.role = agent._original_role = self._original_role or self.role
+        agent.goal = agent._original_goal = self._original_goal or self.goal
+        agent.backstory = agent._original_backstory = (
+            self._original_backstory or self.backstory
+        )
+        return agent
+
+
+# Setup agents (underscore args are skipped by Streamlit's cache hashing)
+@st.cache_resource
+def get_agents(_llm):
     # --- Agents with shorter, more focused descriptions ---
-    financial_analyst_agent = Agent(
+    research_analyst_agent = TemplateAgent(
+        role="Research Analyst",
+        goal="Analyze {company_name} financial metrics and strategic position in one pass.",
+        backstory="You cover both company financials and business strategy for equity research.",
+        tools=[],
+        llm=_llm,
+        verbose=True,
+        allow_delegation=False,
+    )
+
+    # Dedicated analysts, used when the combined analysis can't be parsed
+    financial_analyst_agent = TemplateAgent(
         role="Financial Analyst",
         goal="Analyze {company_name} financial metrics including revenue, profit margins, and debt.",
         backstory="You analyze company financials and extract key performance indicators.",
-        tools=[search_tool],
-        llm=llm,
+        tools=[],
+        llm=_llm,
         verbose=True,
         allow_delegation=False,
     )
 
-    strategy_analyst_agent = Agent(
+    strategy_analyst_agent = TemplateAgent(
         role="Strategy Analyst",
         goal="Research {company_name} competitive position, management guidance, and industry trends.",
         backstory="You evaluate business strategy and competitive advantages.",
-        tools=[search_tool],
-        llm=llm,
-        verbose=True,
-        allow_delegation=False,
-    )
-
-    investment_advisor_agent = Agent(
-        role="Investment Advisor",
-        goal="Create investment report for {company_name} with BUY/SELL/HOLD recommendation.",
-        backstory="You synthesize financial and strategic analysis into actionable investment advice.",
         tools=[],
-        llm=llm,
+        llm=_llm,
         verbose=True,
         allow_delegation=False,
     )
 
+    return research_analyst_agent, financial_analyst_agent, strategy_analyst_agent
+
+
+# Setup tasks
+@st.cache_resource
+def get_tasks(_agents):
+    research_analyst_agent, financial_analyst_agent, strategy_analyst_agent = _agents
+
     # --- Tasks with more concise descriptions ---
-    financial_analysis_task = Task(
+    combined_analysis_task = PrecompiledTask(
+        description=(
+            "Research {company_name} and cover two areas. "
+            "Financial: 1. Revenue growth (YoY) 2. Profit margins (EBITDA, Net) "
+            "3. Debt-to-equity ratio 4. Key highlights from latest quarterly/annual report. "
+            "Strategic: 1. Recent management guidance from earnings calls "
+            "2. Industry outlook and trends 3. Competitive advantages (moat) "
+            "4. Major risks and opportunities. "
+            "Respond with only a JSON object, no surrounding text.\n\n"
+            "Web search results:\n{search_context}"
+        ),
+        expected_output=(
+            'A JSON object {"financial": "<financial summary>", '
+            '"strategic": "<strategic assessment>"} with both values as markdown strings.'
+        ),
+        agent=research_analyst_agent,
+    )
+
+    financial_analysis_task = PrecompiledTask(
         description=(
             "Research and analyze {company_name}'s latest financial performance: "
             "1. Revenue growth (YoY) "
             "2. Profit margins (EBITDA, Net) "
             "3. Debt-to-equity ratio "
-            "4. Key financial highlights from latest quarterly/annual report"
+            "4. Key financial highlights from latest quarterly/annual report\n\n"
+            "Web search results:\n{search_context}"
         ),
         expected_output="Financial summary with key metrics and trends for {company_name}.",
         agent=financial_analyst_agent,
-        async_execution=True,
     )
 
-    strategy_analysis_task = Task(
+    strategy_analysis_task = PrecompiledTask(
         description=(
             "Analyze {company_name}'s strategic position: "
             "1. Recent management guidance from earnings calls "
             "2. Industry outlook and trends "
             "3. Competitive advantages (moat) "
-            "4. Major risks and opportunities"
+            "4. Major risks and opportunities\n\n"
+            "Web search results:\n{search_context}"
         ),
         expected_output="Strategic assessment covering guidance, industry trends, and competitive position.",
         agent=strategy_analyst_agent,
-        async_execution=True,
     )
 
-    report_generation_task = Task(
-        description=(
-            "Create a comprehensive investment report for {company_name} with these sections: "
-            "1. Executive Summary (2-3 sentences) "
-            "2. Financial Performance (key metrics) "
-            "3. Strategic Outlook (management guidance, industry trends) "
-            "4. Competitive Moat (strengths vs competitors) "
-            "5. Investment Recommendation (BUY/SELL/HOLD with clear justification)"
-        ),
-        expected_output="Professional investment report with clear recommendation.",
-        agent=investment_advisor_agent,
-        context=[financial_analysis_task, strategy_analysis_task],
-        async_execution=False,
+    return combined_analysis_task, financial_analysis_task, strategy_analysis_task
+
+
+# Initialize crews
+@st.cache_resource
+def get_crew():
+    agents = get_agents(get_llm())
+    research_analyst_agent, financial_analyst_agent, strategy_analyst_agent = agents
+    combined_analysis_task, financial_analysis_task, strategy_analysis_task = get_tasks(
+        agents
+    )
+
+    # --- Crews: one combined analysis call, with the split analysts as fallback ---
+    analysis_crew = Crew(
+        agents=[research_analyst_agent],
+        tasks=[combined_analysis_task],
+        process=Process.sequential,
+        verbose=True,
     )
 
-    # --- Crew ---
-    crew = Crew(
-        agents=[
-            financial_analyst_agent,
-            strategy_analyst_agent,
-            investment_advisor_agent,
-        ],
-        tasks=[
-            financial_analysis_task,
-            strategy_analysis_task,
-            report_generation_task,
-        ],
+    # The two fallback analysts are independent and run concurrently
+    fin_crew = Crew(
+        agents=[financial_analyst_agent],
+        tasks=[financial_analysis_task],
         process=Process.sequential,
         verbose=True,
-        max_rpm=10,  # Add rate limiting
     )
 
-    return crew
+    strat_crew = Crew(
+        agents=[strategy_analyst_agent],
+        tasks=[strategy_analysis_task],
+        process=Process.sequential,
+        verbose=True,
+    )
+
+    return analysis_crew, fin_crew, strat_crew
+
+
+def parse_combined_analysis(output):
+    """Split the combined analysis JSON into (financial, strategic) strings"""
+    # Tolerate code fences or stray text around the JSON object, and literal
+    # newlines inside the markdown values (strict=False)
+    start, end = output.find("{"), output.rfind("}")
+    data = json.loads(output[start : end + 1], strict=False)
+    if not isinstance(data, dict) or not {"financial", "strategic"} <= data.keys():
+        raise ValueError("Combined analysis is missing 'financial' or 'strategic'")
+    return str(data["financial"]), str(data["strategic"])
+
+
+async def run_analysts(fin_crew, strat_crew, inputs):
+    """Kick off both analyst crews at once so their LLM/search calls overlap"""
+    return await asyncio.gather(
+        fin_crew.kickoff_async(inputs=inputs),
+        strat_crew.kickoff_async(inputs=inputs),
+    )
+
+
+# === REPORT: One direct completion, no agent loop needed to synthesize ===
+REPORT_TEMPLATE = (
+    "Create a comprehensive investment report for {company_name} with these sections: "
+    "1. Executive Summary (2-3 sentences) "
+    "2. Financial Performance (key metrics) "
+    "3. Strategic Outlook (management guidance, industry trends) "
+    "4. Competitive Moat (strengths vs competitors) "
+    "5. Investment Recommendation (BUY/SELL/HOLD with clear justification)\n\n"
+    "Financial analysis:\n{financial_analysis}\n\n"
+    "Strategic analysis:\n{strategic_analysis}"
+)
+
+
+def report_request(inputs):
+    """litellm arguments for the report completion"""
+    return {
+        **llm_settings(),
+        "messages": [{"role": "user", "content": REPORT_TEMPLATE.format_map(inputs)}],
+        "max_tokens": 2000,
+    }
+
+
+def stream_report(inputs, stream_area):
+    """Render the report tokens as they stream in and return the full text"""
+    response = litellm.completion(**report_request(inputs), stream=True)
+    return stream_area.write_stream(
+        chunk.choices[0].delta.content or "" for chunk in response
+    )
+
 
+class EmptyReportError(Exception):
+    """The report completion finished without producing any text"""
 
-def run_analysis(company_name, progress_bar, status_text):
+
+# Errors worth retrying; anything else (bad request, auth) fails immediately
+TRANSIENT_ERRORS = (
+    EmptyReportError,
+    SearchUnavailableError,
+    litellm.RateLimitError,
+    litellm.APIConnectionError,
+    litellm.InternalServerError,
+    litellm.ServiceUnavailableError,
+    litellm.Timeout,
+    TimeoutError,
+)
+
+
+async def run_analysis(company_name, progress_bar, status_text, stream_area):
     """Run the crew analysis with retry logic"""
     max_retries = 3
-    result = None
+
+    # Serve a recent report straight from the cache, no LLM/search calls
+    cache = get_report_cache()
+    key = report_cache_key(company_name)
+    cached_report = cache.get(key)
+    if cached_report:
+        status_text.text(f"⚡ Loaded cached report for {company_name}")
+        progress_bar.progress(100)
+        return cached_report
+
+    # Build (or fetch the cached) crews once and reuse them across retries
+    analysis_crew, fin_crew, strat_crew = get_crew()
 
     for attempt in range(max_retries):
+        # Retries go to the API; the first attempt may have cached a bad response
+        skip_completion_cache.set(attempt > 0)
         try:
             status_text.text(
                 f"🔄 Attempt {attempt + 1}/{max_retries} - Analyzing {company_name}..."
             )
             progress_bar.progress(10)
 
-            # Re-initialize crew on each attempt to avoid state issues
-            crew = initialize_crew()
+            status_text.text("🌐 Searching the web...")
+            progress_bar.progress(20)
+
+            inputs = {
+                "company_name": company_name,
+                "search_context": await asyncio.to_thread(
+                    gather_search_context, company_name
+                ),
+            }
 
-            status_text.text(f"🔍 Gathering financial data...")
+            status_text.text(f"🔍 Gathering financial and strategic data...")
             progress_bar.progress(30)
 
-            result = crew.kickoff(inputs={"company_name": company_name})
+            analysis = await analysis_crew.kickoff_async(inputs=inputs)
+            try:
+                financial, strategic = parse_combined_analysis(str(analysis))
+            except ValueError:
+                # Usually a truncated response; ask the two analysts separately
+                status_text.text("🔍 Splitting analysis across both analysts...")
+                financial, strategic = await run_analysts(fin_crew, strat_crew, inputs)
+
+            status_text.text("📝 Writing investment report...")
+            progress_bar.progress(70)
+
+            report = stream_report(
+                {
+                    "company_name": company_name,
+                    "financial_analysis": str(financial),
+                    "strategic_analysis": str(strategic),
+                },
+                stream_area,
+            )
+            if not report.strip():
+                raise EmptyReportError("The model returned an empty report")
+            cache.set(key, report, expire=REPORT_CACHE_TTL)
 
             status_text.text("✅ Analysis completed successfully!")
             progress_bar.progress(100)
-            return str(result)
+            return report
 
         except Exception as e:
             error_msg = str(e)
             status_text.error(f"⚠️ Attempt {attempt + 1} failed: {error_msg}")
 
-            # Clear cache and retry if it's an API error
-            if "BadRequestError" in error_msg or "empty" in error_msg.lower():
-                st.cache_resource.clear()
+            if not isinstance(e, TRANSIENT_ERRORS):
+                status_text.error(f"❌ Analysis failed. Error: {error_msg}")
+                return None
 
             if attempt < max_retries - 1:
-                wait_time = (attempt + 1) * 3  # Progressive wait
-                status_text.warning(f"⏳ Retrying in {wait_time} seconds...")
-                sleep(wait_time)
+                # Capped exponential backoff with jitter
+                wait_time = min(30, 2**attempt) + random.random()
+                status_text.warning(f"⏳ Retrying in {wait_time:.1f} seconds...")
+                await asyncio.sleep(wait_time)
             else:
                 status_text.error(
                     f"❌ All {max_retries} attempts failed. Error: {error_msg}"
@@ -193,6 +597,301 @@ def run_analysis(company_name, progress_bar, status_text):
     return None
 
 
+# === BATCH MODE: Several companies analyzed concurrently ===
+BATCH_CONCURRENCY = 3  # Crews in flight at once
+
+
+async def kickoff_for_each_limited(crew, inputs_list, sem=None):
+    """kickoff_for_each_async with at most BATCH_CONCURRENCY crews running at once"""
+    # Pass a shared semaphore when several calls run in parallel
+    sem = sem or asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def kickoff_one(inputs):
+        async with sem:
+            # kickoff_for_each_async runs a copy of the crew, so runs don't share state
+            [result] = await crew.kickoff_for_each_async(inputs=[inputs])
+            return result
+
+    return await asyncio.gather(
+        *(kickoff_one(inputs) for inputs in inputs_list), return_exceptions=True
+    )
+
+
+async def gather_search_contexts_limited(companies):
+    """Search contexts with at most BATCH_CONCURRENCY companies searching at once"""
+    sem = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def search_one(company):
+        async with sem:
+            return await asyncio.to_thread(gather_search_context, company)
+
+    return await asyncio.gather(
+        *(search_one(company) for company in companies), return_exceptions=True
+    )
+
+
+async def generate_reports_limited(report_inputs):
+    """Report completions with at most BATCH_CONCURRENCY requests in flight"""
+    sem = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def generate_one(inputs):
+        async with sem:
+            # Sync API in a worker thread so the rate limit hook never blocks the loop
+            response = await asyncio.to_thread(
+                litellm.completion, **report_request(inputs)
+            )
+            report = response.choices[0].message.content
+            if not report or not report.strip():
+                raise EmptyReportError("The model returned an empty report")
+            return report
+
+    return await asyncio.gather(
+        *(generate_one(inputs) for inputs in report_inputs), return_exceptions=True
+    )
+
+
+async def run_batch_analysis(companies, progress_bar, status_text):
+    """Generate reports for several companies; returns {company: (report, error)}"""
+    cache = get_report_cache()
+    results = {}
+    pending = []
+    for company in companies:
+        cached_report = cache.get(report_cache_key(company))
+        if cached_report:
+            results[company] = (cached_report, None)
+        else:
+            pending.append(company)
+
+    if pending:
+        analysis_crew, fin_crew, strat_crew = get_crew()
+
+        status_text.text(f"🌐 Searching the web for {len(pending)} companies...")
+        progress_bar.progress(10)
+        search_contexts = await gather_search_contexts_limited(pending)
+        inputs_list = []
+        for company, search_context in zip(pending, search_contexts):
+            if isinstance(search_context, Exception):
+                results[company] = (None, str(search_context))
+                continue
+            inputs_list.append(
+                {"company_name": company, "search_context": search_context}
+            )
+
+        status_text.text("🔍 Gathering financial and strategic data...")
+        progress_bar.progress(30)
+        analyses = await kickoff_for_each_limited(analysis_crew, inputs_list)
+
+        report_inputs = []
+        fallback_inputs = []
+        for inputs, analysis in zip(inputs_list, analyses):
+            if isinstance(analysis, Exception):
+                results[inputs["company_name"]] = (None, str(analysis))
+                continue
+            try:
+                financial, strategic = parse_combined_analysis(str(analysis))
+            except ValueError:
+                fallback_inputs.append(inputs)
+                continue
+            report_inputs.append(
+                {
+                    "company_name": inputs["company_name"],
+                    "financial_analysis": financial,
+                    "strategic_analysis": strategic,
+                }
+            )
+
+        if fallback_inputs:
+            # Combined output couldn't be split; ask the two analysts separately
+            status_text.text("🔍 Splitting analysis across both analysts...")
+            sem = asyncio.Semaphore(BATCH_CONCURRENCY)
+            financials, strategics = await asyncio.gather(
+                kickoff_for_each_limited(fin_crew, fallback_inputs, sem),
+                kickoff_for_each_limited(strat_crew, fallback_inputs, sem),
+            )
+            for inputs, financial, strategic in zip(
+                fallback_inputs, financials, strategics
+            ):
+                error = next(
+                    (r for r in (financial, strategic) if isinstance(r, Exception)),
+                    None,
+                )
+                if error is not None:
+                    results[inputs["company_name"]] = (None, str(error))
+                    continue
+                report_inputs.append(
+                    {
+                        "company_name": inputs["company_name"],
+                        "financial_analysis": str(financial),
+                        "strategic_analysis": str(strategic),
+                    }
+                )
+
+        status_text.text("📝 Writing investment reports...")
+        progress_bar.progress(70)
+        reports = await generate_reports_limited(report_inputs)
+        for inputs, report in zip(report_inputs, reports):
+            company = inputs["company_name"]
+            if isinstance(report, Exception):
+                results[company] = (None, str(report))
+                continue
+            cache.set(report_cache_key(company), report, expire=REPORT_CACHE_TTL)
+            results[company] = (report, None)
+
+    status_text.text("✅ Batch analysis completed!")
+    progress_bar.progress(100)
+    # Keep the order the companies were entered in
+    return {company: results[company] for company in companies}
+
+
+# === SESSION STORAGE: Reports are kept zstd-compressed in session state ===
+def compress_report(report):
+    return zstd.ZstdCompressor(level=3).compress(report.encode())
+
+
+def decompress_report(blob):
+    return zstd.ZstdDecompressor().decompress(blob).decode()
+
+
+# === PDF EXPORT: Rendered off the script thread once per report ===
+@st.cache_resource
+def get_pdf_executor():
+    return ThreadPoolExecutor(max_workers=2)
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def to_pdf(md, company):
+    # Imported here: WeasyPrint needs system Pango libraries (packages.txt), and a
+    # missing library should only break the PDF export, not the whole app
+    import weasyprint
+
+    # The report is built from web search results, so escape any raw HTML in it
+    # and never let WeasyPrint fetch http(s):// or file:// resources
+    body = markdown2.markdown(md, extras=["tables"], safe_mode="escape")
+    return weasyprint.HTML(
+        string=f"<h1>Investment Report: {html.escape(company)}</h1>{body}",
+        url_fetcher=data_only_url_fetcher(),
+    ).write_pdf()
+
+
+def data_only_url_fetcher():
+    """WeasyPrint URL fetcher that refuses everything except data: URLs"""
+    try:
+        from weasyprint.urls import URLFetcher
+    except ImportError:
+        # Older WeasyPrint releases take a plain callable
+        from weasyprint import default_url_fetcher
+
+        def fetcher(url, *args, **kwargs):
+            if not url.lower().startswith("data:"):
+                raise ValueError(f"Refusing to fetch {url}")
+            return default_url_fetcher(url, *args, **kwargs)
+
+        return fetcher
+
+    return URLFetcher(allowed_protocols={"data"})
+
+
+# === REPORT DISPLAY: Fragments, so download clicks only rerun this section ===
+@st.fragment
+def show_report():
+    """Report and Download tabs for the single-company report"""
+    st.divider()
+    st.header(f"📄 Investment Report: {st.session_state.analyzed_company}")
+    report = decompress_report(st.session_state.report)
+
+    # Create tabs for different views
+    tab1, tab2 = st.tabs(["📖 Report", "💾 Download"])
+
+    with tab1:
+        # Display report with nice formatting
+        st.markdown(report)
+
+    with tab2:
+        # Download options
+        st.subheader("Download Options")
+
+        filename = (
+            f"{st.session_state.analyzed_company.replace(' ', '_')}_Investment_Report"
+        )
+
+        col1, col2, col3 = st.columns(3)
+
+        with col1:
+            # Text file download
+            st.download_button(
+                label="📄 Download as TXT",
+                data=report,
+                file_name=f"{filename}.txt",
+                mime="text/plain",
+                use_container_width=True,
+            )
+
+        with col2:
+            # Markdown file download
+            st.download_button(
+                label="📝 Download as MD",
+                data=report,
+                file_name=f"{filename}.md",
+                mime="text/markdown",
+                use_container_width=True,
+            )
+
+        with col3:
+            # PDF is rendered in the background; offer it once it's ready
+            pdf_future = st.session_state.pdf_future
+            if pdf_future is None:
+                pdf_future = get_pdf_executor().submit(
+                    to_pdf, report, st.session_state.analyzed_company
+                )
+                st.session_state.pdf_future = pdf_future
+
+            if not pdf_future.done():
+                st.button("⏳ Preparing PDF... (refresh)", use_container_width=True)
+            elif pdf_future.exception() is not None:
+                st.error(f"❌ PDF export failed: {pdf_future.exception()}")
+            else:
+                st.download_button(
+                    label="📕 Download as PDF",
+                    data=pdf_future.result(),
+                    file_name=f"{filename}.pdf",
+                    mime="application/pdf",
+                    use_container_width=True,
+                )
+
+        # Compressed download straight from session state, no decoding
+        st.download_button(
+            label="🗜️ Download compressed MD (.zst)",
+            data=st.session_state.report,
+            file_name=f"{filename}.md.zst",
+            mime="application/zstd",
+            use_container_width=True,
+        )
+
+        st.info("💡 Tip: You can copy the report directly from the Report tab")
+
+
+@st.fragment
+def show_batch_reports():
+    """One expander per company from the last batch run"""
+    st.divider()
+    st.header("📚 Batch Reports")
+
+    for company, (blob, error) in st.session_state.batch_reports.items():
+        with st.expander(f"{'📄' if blob else '❌'} {company}"):
+            if blob:
+                report = decompress_report(blob)
+                st.markdown(report)
+                st.download_button(
+                    label="📝 Download as MD",
+                    data=report,
+                    file_name=f"{company.replace(' ', '_')}_Investment_Report.md",
+                    mime="text/markdown",
+                    key=f"batch_download_{company}",
+                )
+            else:
+                st.error(f"Failed to generate report. Error: {error}")
+
+
 # === STREAMLIT UI ===
 def main():
     # Page config
@@ -240,6 +939,9 @@ def main():
 
         # Clear cache button
         if st.button("🔄 Reset Application", use_container_width=True):
+            # Drop saved reports too, so the next run regenerates them
+            get_report_cache().clear()
+            get_completion_cache().cache.flush_cache()
             st.cache_resource.clear()
             st.session_state.clear()
             st.rerun()
@@ -260,76 +962,95 @@ def main():
             "🚀 Generate Report", type="primary", use_container_width=True
         )
 
+    # Batch mode input
+    with st.expander("📚 Batch Mode"):
+        companies_text = st.text_area(
+            "Companies (one per line)",
+            placeholder="Tata Motors\nReliance Industries\nInfosys",
+        )
+        batch_button = st.button("🚀 Generate Batch Reports", use_container_width=True)
+
     # Initialize session state for storing report
     if "report" not in st.session_state:
         st.session_state.report = None
     if "analyzed_company" not in st.session_state:
         st.session_state.analyzed_company = None
+    if "batch_reports" not in st.session_state:
+        st.session_state.batch_reports = None
+    if "pdf_future" not in st.session_state:
+        st.session_state.pdf_future = None
 
     # Analysis execution
     if analyze_button:
         if not company_name or company_name.strip() == "":
             st.error("⚠️ Please enter a company name")
+        elif not is_valid_company_name(company_name):
+            st.error(
+                "⚠️ That doesn't look like a company name. Use letters, numbers, "
+                "spaces and & . , ' ( ) ! * + / - only."
+            )
         elif not os.environ.get("PERPLEXITY_API_KEY"):
             st.error("⚠️ PERPLEXITY_API_KEY not found in environment variables")
         else:
             # Progress indicators
             progress_bar = st.progress(0)
             status_text = st.empty()
+            stream_area = st.empty()
 
             # Run analysis
-            report = run_analysis(company_name, progress_bar, status_text)
+            report = asyncio.run(
+                run_analysis(company_name, progress_bar, status_text, stream_area)
+            )
+            # The finished report is rendered in the Report tab below
+            stream_area.empty()
 
             if report:
-                st.session_state.report = report
+                st.session_state.report = compress_report(report)
                 st.session_state.analyzed_company = company_name
+                # Start the PDF now so it's ready when the Download tab is opened
+                st.session_state.pdf_future = get_pdf_executor().submit(
+                    to_pdf, report, company_name
+                )
                 st.success(f"✅ Report generated for **{company_name}**!")
             else:
                 st.error(
                     "❌ Failed to generate report. Try the 'Reset Application' button in sidebar."
                 )
 
-    # Display report
-    if st.session_state.report:
-        st.divider()
-        st.header(f"📄 Investment Report: {st.session_state.analyzed_company}")
-
-        # Create tabs for different views
-        tab1, tab2 = st.tabs(["📖 Report", "💾 Download"])
-
-        with tab1:
-            # Display report with nice formatting
-            st.markdown(st.session_state.report)
-
-        with tab2:
-            # Download options
-            st.subheader("Download Options")
-
-            filename = f"{st.session_state.analyzed_company.replace(' ', '_')}_Investment_Report"
+    # Batch execution
+    if batch_button:
+        # Drop blank lines and duplicates, keeping the entered order
+        companies = list(
+            dict.fromkeys(c.strip() for c in companies_text.splitlines() if c.strip())
+        )
+        invalid = [c for c in companies if not is_valid_company_name(c)]
+        if invalid:
+            st.warning(f"⚠️ Skipping invalid company names: {', '.join(invalid)}")
+            companies = [c for c in companies if c not in invalid]
 
-            col1, col2 = st.columns(2)
+        if not companies:
+            st.error("⚠️ Please enter at least one company name")
+        elif not os.environ.get("PERPLEXITY_API_KEY"):
+            st.error("⚠️ PERPLEXITY_API_KEY not found in environment variables")
+        else:
+            progress_bar = st.progress(0)
+            status_text = st.empty()
 
-            with col1:
-                # Text file download
-                st.download_button(
-                    label="📄 Download as TXT",
-                    data=st.session_state.report,
-                    file_name=f"{filename}.txt",
-                    mime="text/plain",
-                    use_container_width=True,
-                )
+            batch_reports = asyncio.run(
+                run_batch_analysis(companies, progress_bar, status_text)
+            )
+            st.session_state.batch_reports = {
+                company: (compress_report(report) if report else None, error)
+                for company, (report, error) in batch_reports.items()
+            }
 
-            with col2:
-                # Markdown file download
-                st.download_button(
-                    label="📝 Download as MD",
-                    data=st.session_state.report,
-                    file_name=f"{filename}.md",
-                    mime="text/markdown",
-                    use_container_width=True,
-                )
+    # Display report
+    if st.session_state.report:
+        show_report()
 
-            st.info("💡 Tip: You can copy the report directly from the Report tab")
+    # Display batch reports
+    if st.session_state.batch_reports:
+        show_batch_reports()
 
     # Footer
     st.divider()
@@ -343,5 +1064,20 @@ def main():
     )
 
 
+# === WARM-UP: Build the LLMs, search tool and crews before the first click ===
+@st.cache_resource
+def start_warmup():
+    thread = threading.Thread(
+        target=lambda: (get_search_tool(), get_crew()),
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+
+# Cached, so the thread starts once per process rather than on every rerun
+start_warmup()
+
+
 if __name__ == "__main__":
     main()